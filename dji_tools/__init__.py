@@ -0,0 +1,17 @@
+"""Tools for processing DJI drone footage."""
+
+from dji_tools.merge import (
+    format_dji_filename,
+    get_footage_sequences,
+    list_mp4_files,
+    merge_mp4,
+    merge_sequences,
+)
+
+__all__ = [
+    "format_dji_filename",
+    "get_footage_sequences",
+    "list_mp4_files",
+    "merge_mp4",
+    "merge_sequences",
+]
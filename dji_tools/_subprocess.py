@@ -0,0 +1,38 @@
+"""Subprocess helper shared by the merge and stabilize stages."""
+
+from __future__ import annotations
+
+import collections
+import subprocess
+import threading
+
+
+def run_streamed(cmd, tail_chunks=16, chunk_size=1024):
+    """Run cmd, discarding stdout and keeping only the last ~16 KB of stderr
+
+    Raises CalledProcessError carrying the raw stderr tail (bytes) on a
+    non-zero exit; it is only decoded when printed. The child is killed if
+    the wait is interrupted.
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    tail = collections.deque(maxlen=tail_chunks)
+    
+    def drain():
+        for chunk in iter(lambda: proc.stderr.read(chunk_size), b""):
+            tail.append(chunk)
+    
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    try:
+        returncode = proc.wait()
+    except BaseException:
+        # Interrupted (e.g. Ctrl+C): don't leave the child writing output
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        reader.join()
+        proc.stderr.close()
+    
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, stderr=b"".join(tail))
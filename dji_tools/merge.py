@@ -0,0 +1,346 @@
+"""Merge split DJI footage files into single files.
+
+The drone splits long recordings into ~3.7GB parts; parts of one
+recording are grouped by size and concatenated with mp4-merge.
+"""
+
+from __future__ import annotations
+
+import errno
+import json
+import os
+import shutil
+import subprocess
+from functools import lru_cache
+
+from dji_tools._subprocess import run_streamed
+
+
+def _is_dji(name):
+    """True for names starting with DJI_ followed by a 14-digit timestamp"""
+    return len(name) >= 18 and name[:4] == 'DJI_' and name[4:18].isdigit()
+
+
+def format_dji_filename(dji_filename):
+    """
+    Extract timestamp from DJI filename and format as YYYY.MM.DD HH.MM
+    Example: DJI_20251230055808_0001_D.MP4 -> 2025.12.30 05.58
+    """
+    if not _is_dji(dji_filename):
+        raise ValueError(f"Not a DJI footage filename: {dji_filename}")
+    ts = dji_filename[4:18]
+    return f"{ts[:4]}.{ts[4:6]}.{ts[6:8]} {ts[8:10]}.{ts[10:12]}"
+
+
+def _fast_copy(src, dst):
+    """Copy src to dst keeping the data in the kernel where possible
+
+    Tries os.copy_file_range, then os.sendfile, then a buffered userspace
+    copy. A strategy that errors out or stops short (returns 0 early) is
+    treated as unsupported and the next one starts over. Raises OSError if
+    dst does not end up the same size as src. File metadata is preserved
+    like shutil.copy2.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        sfd, dfd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(sfd).st_size
+        
+        def kernel_copy(name):
+            func = getattr(os, name, None)
+            if func is None:
+                return False
+            remaining = size
+            try:
+                while remaining > 0:
+                    if name == "copy_file_range":
+                        sent = func(sfd, dfd, remaining)
+                    else:
+                        sent = func(dfd, sfd, None, remaining)
+                    if sent == 0:
+                        return False
+                    remaining -= sent
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+                return False
+            return True
+        
+        for name in ("copy_file_range", "sendfile"):
+            if kernel_copy(name):
+                break
+            # Unsupported here: rewind and let the next strategy start over
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+        else:
+            shutil.copyfileobj(fsrc, fdst, 4 * 1024 * 1024)
+        
+        fdst.flush()
+        copied = os.fstat(dfd).st_size
+        if copied != size:
+            raise OSError(errno.EIO, f"Short copy: {copied} of {size} bytes", dst)
+    
+    shutil.copystat(src, dst)
+
+
+def _remove_part(path):
+    """Remove a partially written output, if any"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _rename_no_clobber(src, dst):
+    """Rename src to dst, raising FileExistsError instead of replacing dst
+
+    Uses link + unlink so the check is atomic; falls back to an existence
+    check on filesystems without hard links. EXDEV is passed through.
+    """
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno in (errno.EEXIST, errno.EXDEV):
+            raise
+        if os.path.lexists(dst):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+        os.rename(src, dst)
+        return
+    os.unlink(src)
+
+
+def _move_file(src, dst):
+    """Move src to dst, copying through a .part file across filesystems
+
+    Never overwrites an existing dst. The source is only removed once the
+    complete copy is in place; a failed copy leaves src untouched and no
+    partial dst behind.
+    """
+    try:
+        _rename_no_clobber(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    
+    # Source and target are on different mounts
+    part_path = dst + ".part"
+    try:
+        _fast_copy(src, part_path)
+        _rename_no_clobber(part_path, dst)
+    except BaseException:
+        _remove_part(part_path)
+        raise
+    os.unlink(src)
+
+
+@lru_cache(maxsize=1)
+def _mp4_merge_path():
+    """Locate the mp4-merge binary once per run"""
+    mp4_merge_path = shutil.which("mp4-merge")
+    if mp4_merge_path:
+        return mp4_merge_path
+    
+    cargo_bin_paths = [
+        os.path.expanduser("~/.cargo/bin/mp4-merge"),
+        os.path.expanduser("~/.cargo/bin/mp4_merge")
+    ]
+    for path in cargo_bin_paths:
+        if os.path.isfile(path):
+            return path
+    
+    raise FileNotFoundError("mp4-merge not found. Install from https://github.com/gyroflow/mp4-merge")
+
+
+def _drop_page_cache(paths):
+    """Ask the kernel to evict cached pages of files we will not read again"""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def merge_mp4(input_files, output_file):
+    """Merge MP4 files using mp4-merge tool
+
+    mp4-merge writes to `output_file + ".part"`, which is renamed into place
+    only on success, so a failed or interrupted merge never leaves a
+    truncated file under the final name. An existing output_file is never
+    replaced; FileExistsError is raised instead.
+    """
+    part_file = output_file + ".part"
+    cmd = [_mp4_merge_path()] + input_files + ["--out", part_file]
+    
+    try:
+        run_streamed(cmd)
+        _rename_no_clobber(part_file, output_file)
+    except subprocess.CalledProcessError as e:
+        _remove_part(part_file)
+        print(f"✗ Error merging files: {e}")
+        print(f"STDERR: {e.stderr[-4096:].decode('utf-8', 'replace')}")
+        return False
+    except BaseException:
+        _remove_part(part_file)
+        raise
+    
+    print(f"✓ Merged to {output_file}")
+    # The split parts are not read again; free their page cache. The
+    # merged output is kept cached since Gyroflow reads it next.
+    _drop_page_cache(input_files)
+    return True
+
+
+def list_mp4_files(folder):
+    """List DJI MP4 files in folder as (name, size) tuples, sorted by name"""
+    with os.scandir(folder) as it:
+        return sorted(
+            ((e.name, e.stat(follow_symlinks=False).st_size)
+             for e in it
+             if e.is_file(follow_symlinks=False) and _is_dji(e.name) and e.name.endswith('.MP4')),
+            key=lambda t: t[0],
+        )
+
+
+def get_footage_sequences(files):
+    """Group (name, size) split files into sequences based on file size, yielding each one"""
+    split_limit = 3760000000  # ~3.7GB
+    max_limit = 4000000000  # ~4.0GB
+    parts = []
+    
+    for file, file_size in files:
+        if file_size > max_limit:
+            continue  # skip already merged files
+        
+        parts.append(file)
+        if file_size <= split_limit:
+            yield parts
+            parts = []
+
+
+def _plan_key(source_folder):
+    """Cheap fingerprint of the source folder: its mtime and DJI clip count
+
+    Adding, removing or renaming clips updates the directory mtime; counting
+    uses d_type only, so no clip is stat'ed.
+    """
+    mtime = os.stat(source_folder).st_mtime_ns
+    with os.scandir(source_folder) as it:
+        count = sum(
+            1 for e in it
+            if e.is_file(follow_symlinks=False) and _is_dji(e.name) and e.name.endswith('.MP4')
+        )
+    return [mtime, count]
+
+
+def _load_plan(plan_path, key):
+    """Return the cached merge plan if it was built for `key`, else None"""
+    try:
+        with open(plan_path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("key") != key:
+        return None
+    return data.get("sequences")
+
+
+def _build_plan(source_folder):
+    """Group the source clips into a list of {output, inputs, size} entries"""
+    source_files = list_mp4_files(source_folder)
+    sizes = dict(source_files)
+    return [
+        {
+            "output": format_dji_filename(seq[0]) + ".mp4",
+            "inputs": seq,
+            "size": sum(sizes[f] for f in seq),
+        }
+        for seq in get_footage_sequences(source_files)
+    ]
+
+
+def _save_plan(plan_path, key, plan):
+    """Atomically write the merge plan and the source key it was built for"""
+    tmp_path = plan_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"key": key, "sequences": plan}, f)
+    os.replace(tmp_path, plan_path)
+
+
+def merge_sequences(source_folder, target_folder, on_merged=None, schedule="name"):
+    """Merge split DJI footage files into single files
+
+    The grouping is saved to `.merge_plan.json` in `target_folder` and reused
+    while the source folder is unchanged, so reruns skip re-sizing every clip.
+    Single-file moves take their clip out of the source folder; the plan is
+    re-keyed after each one so it stays valid for the next run.
+    `on_merged(output_path)` is called after each file is written.
+    With `schedule="lpt"` the sequences with the most parts are merged first.
+    """
+    os.makedirs(target_folder, exist_ok=True)
+    with os.scandir(target_folder) as it:
+        existing = {e.name for e in it}
+    
+    plan_path = os.path.join(target_folder, ".merge_plan.json")
+    key = _plan_key(source_folder)
+    plan = _load_plan(plan_path, key)
+    reused = plan is not None
+    if not reused:
+        plan = _build_plan(source_folder)
+        _save_plan(plan_path, key, plan)
+    
+    pending = [entry for entry in plan if entry["output"] not in existing]
+    if schedule == "lpt":
+        pending.sort(key=lambda entry: -len(entry["inputs"]))
+    
+    print(f"\n{'='*80}")
+    print(f"STEP 1: MERGING SPLIT FILES")
+    print(f"{'='*80}")
+    if reused:
+        print(f"Reusing merge plan: {plan_path}")
+    print(f"Found {len(pending)} sequences to process\n")
+    
+    for idx, entry in enumerate(pending, start=1):
+        output_filename = entry["output"]
+        output_path = os.path.join(target_folder, output_filename)
+        
+        print(f"\n-- {idx}/{len(pending)} " + "-" * 70)
+        
+        # Output names only go down to the minute, so two recordings started
+        # in the same minute map to the same file; keep the first one
+        if output_filename in existing:
+            print(f"- Skip (exists): {output_filename}")
+            continue
+        
+        input_files = [os.path.join(source_folder, f) for f in entry["inputs"]]
+        print(f"* Processing: {output_filename}")
+        print(f"  Input files: {len(input_files)}")
+        
+        # Single file: just rename
+        if len(input_files) == 1:
+            print(f"  Single file, moving...")
+            _move_file(input_files[0], output_path)
+            existing.add(output_filename)
+            print(f"✓ Moved to {output_path}")
+            # Our own move changed the source mtime and clip count
+            plan.remove(entry)
+            key = [os.stat(source_folder).st_mtime_ns, key[1] - 1]
+            _save_plan(plan_path, key, plan)
+            if on_merged is not None:
+                on_merged(output_path)
+            continue
+        
+        # Multiple files: merge
+        print(f"  Merging {len(input_files)} files...")
+        if merge_mp4(input_files, output_path):
+            existing.add(output_filename)
+            if on_merged is not None:
+                on_merged(output_path)
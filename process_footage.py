@@ -1,7 +1,7 @@
 """Process DJI drone footage: merge split files and stabilize using Gyroflow.
 
 Workflow:
-1. Merge split DJI footage files from source into merged footage
+1. Merge split DJI footage files from source into merged footage (dji_tools.merge)
 2. Stabilize merged footage using Gyroflow
 
 Configuration:
@@ -13,13 +13,21 @@ Configuration:
 
 from __future__ import annotations
 
+import argparse
 import json
 import os
+import queue
 import shutil
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 
+from dji_tools._subprocess import run_streamed
+from dji_tools.merge import merge_sequences
+
 
 # Folder configuration
 source_folder = "/srv/storage/_"
@@ -28,118 +36,7 @@ stabilized_folder = "/srv/storage/drone_footage"
 
 
 # ============================================================================
-# PART 1: MERGE SPLIT FILES
-# ============================================================================
-
-def format_dji_filename(dji_filename):
-    """
-    Extract timestamp from DJI filename and format as YYYY.MM.DD HH.MM
-    Example: DJI_20251230055808_0001_D.MP4 -> 2025.12.30 05.58
-    """
-    timestamp_str = dji_filename.split('_')[1]
-    year = timestamp_str[:4]
-    month = timestamp_str[4:6]
-    day = timestamp_str[6:8]
-    hour = timestamp_str[8:10]
-    minute = timestamp_str[10:12]
-    return f"{year}.{month}.{day} {hour}.{minute}"
-
-
-def merge_mp4(input_files, output_file):
-    """Merge MP4 files using mp4-merge tool"""
-    mp4_merge_path = shutil.which("mp4-merge")
-    if not mp4_merge_path:
-        cargo_bin_paths = [
-            os.path.expanduser("~/.cargo/bin/mp4-merge"),
-            os.path.expanduser("~/.cargo/bin/mp4_merge")
-        ]
-        for path in cargo_bin_paths:
-            if os.path.isfile(path):
-                mp4_merge_path = path
-                break
-        
-        if not mp4_merge_path:
-            raise FileNotFoundError("mp4-merge not found. Install from https://github.com/gyroflow/mp4-merge")
-    
-    cmd = [mp4_merge_path] + input_files + ["--out", output_file]
-    
-    try:
-        subprocess.run(cmd, check=True, capture_output=True, text=True)
-        print(f"✓ Merged to {output_file}")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"✗ Error merging files: {e}")
-        print(f"STDERR: {e.stderr}")
-        return False
-
-
-def list_mp4_files(folder):
-    """List all MP4 files in folder, sorted by name"""
-    files = [f for f in os.listdir(folder) if f.endswith('.MP4')]
-    files.sort()
-    return files
-
-
-def get_footage_sequences(files, source_folder):
-    """Group split files into sequences based on file size"""
-    split_limit = 3760000000  # ~3.7GB
-    max_limit = 4000000000  # ~4.0GB
-    footage_files = []
-    parts = []
-    
-    for file in files:
-        file_size = os.path.getsize(os.path.join(source_folder, file))
-        if file_size > max_limit:
-            continue  # skip already merged files
-        
-        if file_size > split_limit:
-            parts.append(file)
-        else:
-            parts.append(file)
-            footage_files.append(parts)
-            parts = []
-    
-    return footage_files
-
-
-def merge_sequences(source_folder, target_folder):
-    """Merge split DJI footage files into single files"""
-    source_files = list_mp4_files(source_folder)
-    footage_sequences = get_footage_sequences(source_files, source_folder)
-    
-    print(f"\n{'='*80}")
-    print(f"STEP 1: MERGING SPLIT FILES")
-    print(f"{'='*80}")
-    print(f"Found {len(footage_sequences)} sequences to process\n")
-    
-    for idx, seq in enumerate(footage_sequences, start=1):
-        output_filename = format_dji_filename(seq[0]) + ".mp4"
-        output_path = os.path.join(target_folder, output_filename)
-        
-        print(f"\n-- {idx}/{len(footage_sequences)} " + "-" * 70)
-        
-        if os.path.exists(output_path):
-            print(f"- Skip (exists): {output_filename}")
-            continue
-        
-        input_files = [os.path.join(source_folder, f) for f in seq]
-        print(f"* Processing: {output_filename}")
-        print(f"  Input files: {len(input_files)}")
-        
-        # Single file: just rename
-        if len(input_files) == 1:
-            print(f"  Single file, moving...")
-            os.rename(input_files[0], output_path)
-            print(f"✓ Moved to {output_path}")
-            continue
-        
-        # Multiple files: merge
-        print(f"  Merging {len(input_files)} files...")
-        merge_mp4(input_files, output_path)
-
-
-# ============================================================================
-# PART 2: STABILIZE WITH GYROFLOW
+# STABILIZE WITH GYROFLOW
 # ============================================================================
 
 @dataclass(frozen=True)
@@ -148,6 +45,7 @@ class StabilizationParams:
     horizon_lock_percent: float = 80.0
 
 
+@lru_cache(maxsize=1)
 def find_gyroflow_binary() -> str:
     """Find Gyroflow executable"""
     here = Path(__file__).resolve().parent
@@ -164,9 +62,9 @@ def find_gyroflow_binary() -> str:
     )
 
 
-def to_file_uri(folder: Path) -> str:
+def to_file_uri(folder: str | Path) -> str:
     """Convert folder path to file:// URI"""
-    return folder.resolve().as_uri().rstrip("/") + "/"
+    return Path(folder).resolve().as_uri().rstrip("/") + "/"
 
 
 def build_preset(params: StabilizationParams) -> str:
@@ -180,10 +78,10 @@ def build_preset(params: StabilizationParams) -> str:
     return json.dumps(preset, separators=(",", ":"))
 
 
-def build_out_params(target_dir: Path, output_filename: str) -> str:
-    """Build Gyroflow output parameters JSON"""
+def build_out_params(target_uri: str, output_filename: str) -> str:
+    """Build Gyroflow output parameters JSON for a prebuilt folder URI"""
     out_params = {
-        "output_folder": to_file_uri(target_dir),
+        "output_folder": target_uri,
         "output_filename": output_filename,
         "use_gpu": False,
         "codec": "H.264/AVC",
@@ -192,57 +90,126 @@ def build_out_params(target_dir: Path, output_filename: str) -> str:
     return json.dumps(out_params, separators=(",", ":"))
 
 
+_OUTPUT_NAME_PLACEHOLDER = "__NAME__"
+
+
+def build_out_params_template(target_uri: str) -> str:
+    """Build Gyroflow output parameters JSON once per run, with a filename placeholder"""
+    return build_out_params(target_uri, _OUTPUT_NAME_PLACEHOLDER)
+
+
+def fill_out_params(template: str, output_filename: str) -> str:
+    """Substitute the output filename into a template from build_out_params_template"""
+    return template.replace(
+        json.dumps(_OUTPUT_NAME_PLACEHOLDER), json.dumps(output_filename), 1
+    )
+
+
 def stabilize_file(
     *,
     gyroflow_bin: str,
-    input_path: Path,
-    target_dir: Path,
-    params: StabilizationParams,
+    input_path: str,
+    target_dir: str,
+    preset: str,
+    out_params_template: str,
     overwrite: bool,
+    existing_size: int | None = None,
 ) -> None:
-    """Stabilize a single video file using Gyroflow"""
-    output_path = target_dir / input_path.name
-    tmp_output_path = output_path.with_suffix(output_path.suffix + ".tmp")
+    """Stabilize a single video file using Gyroflow
+
+    `preset` and `out_params_template` come from build_preset and
+    build_out_params_template, computed once per run by the caller.
+    `existing_size` is the output size already known from a directory scan
+    (0 if absent); when given, the output is not stat'ed before rendering.
+    """
+    filename = os.path.basename(input_path)
+    output_path = os.path.join(target_dir, filename)
+    tmp_output_path = output_path + ".tmp"
+    
+    if existing_size is None:
+        existing_size = os.stat(output_path).st_size if os.path.exists(output_path) else 0
     
-    if output_path.exists() and not overwrite:
-        print(f"- Skip (exists): {output_path.name}")
+    if existing_size > 0 and not overwrite:
+        print(f"- Skip (exists): {filename}")
         return
     
-    target_dir.mkdir(parents=True, exist_ok=True)
+    os.makedirs(target_dir, exist_ok=True)
     
-    if overwrite:
-        output_path.unlink(missing_ok=True)
-        tmp_output_path.unlink(missing_ok=True)
+    if overwrite or existing_size == 0:
+        # Empty outputs are left behind by failed renders
+        for path in (output_path, tmp_output_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
     
     cmd = [
         gyroflow_bin,
-        str(input_path),
+        input_path,
         "--preset",
-        build_preset(params),
+        preset,
         "--out-params",
-        build_out_params(target_dir, input_path.name),
+        fill_out_params(out_params_template, filename),
         "--parallel-renders", "1",
         "--no-gpu-decoding",
     ]
     if overwrite:
         cmd.append("--overwrite")
     
-    print(f"* Stabilizing: {input_path.name}")
-    subprocess.run(cmd, check=True)
+    print(f"* Stabilizing: {filename}")
+    run_streamed(cmd)
     
-    if not output_path.exists() or output_path.stat().st_size == 0:
-        if tmp_output_path.exists() and tmp_output_path.stat().st_size == 0:
-            tmp_output_path.unlink(missing_ok=True)
+    if not os.path.exists(output_path) or os.stat(output_path).st_size == 0:
+        if os.path.exists(tmp_output_path) and os.stat(tmp_output_path).st_size == 0:
+            os.unlink(tmp_output_path)
         raise RuntimeError(f"Gyroflow failed to produce valid output: {output_path}")
     
     print(f"✓ Wrote: {output_path}")
 
 
-def stabilize_footage(source_folder, target_folder):
-    """Stabilize all MP4 files using Gyroflow"""
-    source_files = [
-        f for f in os.listdir(source_folder) if f.lower().endswith(".mp4")
-    ]
+def report_failure(filename: str, error: BaseException) -> None:
+    """Print a stabilization failure, with Gyroflow's stderr tail if it has one"""
+    print(f"✗ Error stabilizing {filename}: {error}")
+    if isinstance(error, subprocess.CalledProcessError) and error.stderr:
+        print(f"STDERR: {error.stderr[-4096:].decode('utf-8', 'replace')}")
+
+
+def default_jobs(file_count: int | None = None) -> int:
+    """Default number of concurrent Gyroflow renders.
+
+    Each render is already multi-threaded, so only use a quarter of the cores,
+    and never more than `file_count` when the number of files is known.
+    """
+    jobs = max(1, (os.cpu_count() or 1) // 4)
+    if file_count is not None:
+        jobs = max(1, min(jobs, file_count))
+    return jobs
+
+
+def default_schedule(jobs: int) -> str:
+    """Largest-first scheduling only pays off with several concurrent jobs"""
+    return "lpt" if jobs > 1 else "name"
+
+
+def stabilize_footage(source_folder, target_folder, jobs=None, schedule=None):
+    """Stabilize all MP4 files using Gyroflow, running up to `jobs` renders at once
+
+    Every failure is reported as it happens; once all renders have finished,
+    a RuntimeError listing the failed files is raised.
+
+    `schedule` is "name" (alphabetical) or "lpt" (largest file first, so long
+    renders do not straggle at the end); it defaults to lpt when jobs > 1.
+    """
+    with os.scandir(source_folder) as it:
+        source_files = sorted(
+            (e.name, e.stat(follow_symlinks=False).st_size) for e in it
+            if e.is_file(follow_symlinks=False) and e.name.lower().endswith(".mp4")
+        )
+    if os.path.isdir(target_folder):
+        with os.scandir(target_folder) as it:
+            existing = {e.name: e.stat(follow_symlinks=False).st_size for e in it if e.is_file(follow_symlinks=False)}
+    else:
+        existing = {}
     
     print(f"\n{'='*80}")
     print(f"STEP 2: STABILIZING FOOTAGE")
@@ -250,41 +217,157 @@ def stabilize_footage(source_folder, target_folder):
     print(f"Found {len(source_files)} files to stabilize\n")
     
     gyroflow_bin = find_gyroflow_binary()
-    params = StabilizationParams()
-    target_dir = Path(target_folder)
+    preset = build_preset(StabilizationParams())
+    out_params_template = build_out_params_template(to_file_uri(target_folder))
     
-    for idx, filename in enumerate(source_files, start=1):
-        print(f"\n-- {idx}/{len(source_files)} " + "-" * 70)
-        
-        if (target_dir / filename).exists():
+    pending = []
+    for filename, size in source_files:
+        if existing.get(filename, 0) > 0:
             print(f"- Skip (exists): {filename}")
             continue
-        
-        input_path = Path(source_folder) / filename
+        pending.append((filename, size))
+    
+    if not pending:
+        return
+    
+    if jobs is None:
+        jobs = default_jobs(len(pending))
+    if schedule is None:
+        schedule = default_schedule(jobs)
+    if schedule == "lpt":
+        pending.sort(key=lambda item: -item[1])
+    pending = [filename for filename, _ in pending]
+    print(f"\nStabilizing {len(pending)} files with {jobs} parallel job(s)")
+    
+    def run(idx, filename):
+        print(f"\n-- {idx}/{len(pending)} " + "-" * 70)
         stabilize_file(
             gyroflow_bin=gyroflow_bin,
-            input_path=input_path,
-            target_dir=target_dir,
-            params=params,
+            input_path=os.path.join(source_folder, filename),
+            target_dir=target_folder,
+            preset=preset,
+            out_params_template=out_params_template,
             overwrite=False,
+            existing_size=existing.get(filename, 0),
         )
+    
+    # Gyroflow runs as a subprocess, so threads are enough to drive several
+    # renders concurrently.
+    failed = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(run, idx, filename): filename
+            for idx, filename in enumerate(pending, start=1)
+        }
+        for future in as_completed(futures):
+            error = future.exception()
+            if error is not None:
+                report_failure(futures[future], error)
+                failed.append(futures[future])
+    
+    if failed:
+        raise RuntimeError(
+            f"{len(failed)} of {len(pending)} files failed to stabilize: "
+            + ", ".join(sorted(failed))
+        )
+
+
+def stabilize_queue(work_queue, target_folder, jobs=None):
+    """Stabilize files taken from `work_queue` until a None sentinel arrives
+
+    At most `jobs` renders are in flight; further paths stay in the queue,
+    so a bounded queue holds the producer back. Failures are reported and
+    skipped; the final stabilize_footage pass retries them.
+    """
+    gyroflow_bin = find_gyroflow_binary()
+    preset = build_preset(StabilizationParams())
+    out_params_template = build_out_params_template(to_file_uri(target_folder))
+    if jobs is None:
+        jobs = default_jobs()
+    slots = threading.BoundedSemaphore(jobs)
+    
+    def run(input_path):
+        try:
+            stabilize_file(
+                gyroflow_bin=gyroflow_bin,
+                input_path=input_path,
+                target_dir=target_folder,
+                preset=preset,
+                out_params_template=out_params_template,
+                overwrite=False,
+            )
+        except Exception as e:
+            report_failure(os.path.basename(input_path), e)
+        finally:
+            slots.release()
+    
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while True:
+            path = work_queue.get()
+            if path is None:
+                break
+            slots.acquire()
+            pool.submit(run, path)
 
 
 # ============================================================================
 # MAIN
 # ============================================================================
 
-if __name__ == "__main__":
+def _positive_int(value: str) -> int:
+    """argparse type for counts that must be at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge and stabilize DJI drone footage")
+    parser.add_argument(
+        "--jobs", type=_positive_int, default=None,
+        help="Number of concurrent Gyroflow renders (default: cpu_count // 4)",
+    )
+    parser.add_argument(
+        "--schedule", choices=("lpt", "name"), default=None,
+        help="Process largest files first (lpt) or in name order "
+             "(default: lpt when more than one job runs)",
+    )
+    args = parser.parse_args()
+    schedule = args.schedule or default_schedule(
+        args.jobs or default_jobs()
+    )
+    
     print("\nDJI FOOTAGE PROCESSING PIPELINE")
     print("=" * 80)
     
-    # Step 1: Merge split files
-    merge_sequences(source_folder, merged_folder)
+    # Step 1: Merge split files, stabilizing each one as soon as it is written
+    find_gyroflow_binary()  # fail before merging if Gyroflow is missing
+    merged_queue = queue.Queue(maxsize=2)
+    consumer = threading.Thread(
+        target=stabilize_queue,
+        args=(merged_queue, stabilized_folder, args.jobs),
+    )
+    consumer.start()
+    try:
+        merge_sequences(
+            source_folder, merged_folder,
+            on_merged=merged_queue.put, schedule=schedule,
+        )
+    finally:
+        merged_queue.put(None)
+        consumer.join()
     
-    # Step 2: Stabilize merged footage
-    stabilize_footage(merged_folder, stabilized_folder)
+    # Step 2: Stabilize merged footage left over from earlier runs
+    stabilize_footage(
+        merged_folder, stabilized_folder, jobs=args.jobs, schedule=schedule,
+    )
     
     print(f"\n{'='*80}")
     print("PROCESSING COMPLETE")
     print(f"{'='*80}")
     print(f"Final output: {stabilized_folder}\n")
+
+
+if __name__ == "__main__":
+    main()
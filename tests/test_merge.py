@@ -0,0 +1,209 @@
+"""Tests for dji_tools.merge"""
+
+import contextlib
+import errno
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from dji_tools import merge
+
+
+class FootageSequencesTest(unittest.TestCase):
+    def test_groups_split_parts(self):
+        files = [
+            ("DJI_20251230055808_0001_D.MP4", 3800000000),
+            ("DJI_20251230060808_0002_D.MP4", 100),
+            ("DJI_20251231055808_0003_D.MP4", 5000000000),  # already merged
+            ("DJI_20251231065908_0004_D.MP4", 10),
+        ]
+        self.assertEqual(list(merge.get_footage_sequences(files)), [
+            ["DJI_20251230055808_0001_D.MP4", "DJI_20251230060808_0002_D.MP4"],
+            ["DJI_20251231065908_0004_D.MP4"],
+        ])
+
+
+class MergeSequencesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, "source")
+        self.target = os.path.join(self.tmp.name, "merged")
+        os.mkdir(self.source)
+        for name in ("DJI_20251231070000_0001_D.MP4", "DJI_20251231080000_0002_D.MP4"):
+            with open(os.path.join(self.source, name), "wb") as f:
+                f.write(b"clip")
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def run_merge(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            merge.merge_sequences(self.source, self.target)
+        return out.getvalue()
+    
+    def test_plan_survives_own_moves(self):
+        first = self.run_merge()
+        self.assertIn("Found 2 sequences", first)
+        self.assertEqual(os.listdir(self.source), [])
+        
+        second = self.run_merge()
+        self.assertIn("Reusing merge plan", second)
+        self.assertIn("Found 0 sequences", second)
+    
+    def test_same_minute_clips_keep_the_first(self):
+        for name, data in (("DJI_20251231090005_0003_D.MP4", b"AAAA"),
+                           ("DJI_20251231090045_0004_D.MP4", b"BBBBBB")):
+            with open(os.path.join(self.source, name), "wb") as f:
+                f.write(data)
+        
+        output = self.run_merge()
+        self.assertIn("Skip (exists): 2025.12.31 09.00.mp4", output)
+        with open(os.path.join(self.target, "2025.12.31 09.00.mp4"), "rb") as f:
+            self.assertEqual(f.read(), b"AAAA")
+        self.assertEqual(os.listdir(self.source), ["DJI_20251231090045_0004_D.MP4"])
+    
+    def test_new_clip_rebuilds_plan(self):
+        self.run_merge()
+        with open(os.path.join(self.source, "DJI_20251231090000_0003_D.MP4"), "wb") as f:
+            f.write(b"clip")
+        
+        output = self.run_merge()
+        self.assertNotIn("Reusing merge plan", output)
+        self.assertIn("Found 1 sequences", output)
+
+
+def _unsupported(*args):
+    raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+
+class FastCopyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, "src.bin")
+        self.dst = os.path.join(self.tmp.name, "dst.bin")
+        self.data = os.urandom(100 * 1024)
+        with open(self.src, "wb") as f:
+            f.write(self.data)
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def assertCopied(self):
+        with open(self.dst, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+    
+    def test_copy_file_range(self):
+        merge._fast_copy(self.src, self.dst)
+        self.assertCopied()
+    
+    def test_falls_back_to_sendfile(self):
+        with mock.patch.object(os, "copy_file_range", _unsupported, create=True):
+            merge._fast_copy(self.src, self.dst)
+        self.assertCopied()
+    
+    def test_falls_back_to_userspace_copy(self):
+        with mock.patch.object(os, "copy_file_range", _unsupported, create=True), \
+                mock.patch.object(os, "sendfile", _unsupported, create=True):
+            merge._fast_copy(self.src, self.dst)
+        self.assertCopied()
+    
+    def test_zero_return_falls_through(self):
+        with mock.patch.object(os, "copy_file_range", return_value=0, create=True):
+            merge._fast_copy(self.src, self.dst)
+        self.assertCopied()
+    
+    def test_zero_return_after_partial_copy_falls_through(self):
+        real = os.copy_file_range
+        calls = []
+        
+        def partial(sfd, dfd, count):
+            calls.append(count)
+            return real(sfd, dfd, 1024) if len(calls) == 1 else 0
+        
+        with mock.patch.object(os, "copy_file_range", partial, create=True):
+            merge._fast_copy(self.src, self.dst)
+        self.assertCopied()
+    
+    def test_short_copy_raises(self):
+        with mock.patch.object(os, "copy_file_range", return_value=0, create=True), \
+                mock.patch.object(os, "sendfile", return_value=0, create=True), \
+                mock.patch.object(merge.shutil, "copyfileobj"):
+            with self.assertRaises(OSError):
+                merge._fast_copy(self.src, self.dst)
+
+
+_real_link = os.link
+
+
+def _cross_device(src, dst):
+    """os.link that treats anything named src.bin as living on another mount"""
+    if os.path.basename(src) == "src.bin":
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    return _real_link(src, dst)
+
+
+class MoveFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, "src.bin")
+        self.dst = os.path.join(self.tmp.name, "dst.bin")
+        with open(self.src, "wb") as f:
+            f.write(b"footage")
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_rename(self):
+        merge._move_file(self.src, self.dst)
+        self.assertFalse(os.path.exists(self.src))
+        with open(self.dst, "rb") as f:
+            self.assertEqual(f.read(), b"footage")
+    
+    def test_cross_device_copies_then_unlinks(self):
+        with mock.patch.object(os, "link", _cross_device):
+            merge._move_file(self.src, self.dst)
+        self.assertFalse(os.path.exists(self.src))
+        self.assertFalse(os.path.exists(self.dst + ".part"))
+        with open(self.dst, "rb") as f:
+            self.assertEqual(f.read(), b"footage")
+    
+    def test_refuses_to_overwrite(self):
+        with open(self.dst, "wb") as f:
+            f.write(b"other")
+        with self.assertRaises(FileExistsError):
+            merge._move_file(self.src, self.dst)
+        self.assertTrue(os.path.exists(self.src))
+        with open(self.dst, "rb") as f:
+            self.assertEqual(f.read(), b"other")
+    
+    def test_cross_device_refuses_to_overwrite(self):
+        with open(self.dst, "wb") as f:
+            f.write(b"other")
+        with mock.patch.object(os, "link", _cross_device):
+            with self.assertRaises(FileExistsError):
+                merge._move_file(self.src, self.dst)
+        self.assertTrue(os.path.exists(self.src))
+        self.assertFalse(os.path.exists(self.dst + ".part"))
+        with open(self.dst, "rb") as f:
+            self.assertEqual(f.read(), b"other")
+    
+    def test_failed_copy_keeps_source(self):
+        def no_space(src, dst):
+            with open(dst, "wb") as f:
+                f.write(b"foot")
+            raise OSError(errno.ENOSPC, "No space left on device")
+        
+        with mock.patch.object(os, "link", _cross_device), \
+                mock.patch.object(merge, "_fast_copy", no_space):
+            with self.assertRaises(OSError):
+                merge._move_file(self.src, self.dst)
+        self.assertTrue(os.path.exists(self.src))
+        self.assertFalse(os.path.exists(self.dst))
+        self.assertFalse(os.path.exists(self.dst + ".part"))
+
+
+if __name__ == "__main__":
+    unittest.main()
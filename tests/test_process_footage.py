@@ -0,0 +1,217 @@
+"""Tests for the Gyroflow stage in process_footage"""
+
+import contextlib
+import io
+import json
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import process_footage
+
+
+def _gyroflow_writes_output(cmd):
+    """Stand-in for run_streamed that writes the output Gyroflow would"""
+    out_params = json.loads(cmd[cmd.index("--out-params") + 1])
+    folder = out_params["output_folder"][len("file://"):]
+    with open(os.path.join(folder, out_params["output_filename"]), "wb") as f:
+        f.write(b"stabilized")
+
+
+class StabilizeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, "merged")
+        self.target = os.path.join(self.tmp.name, "stabilized")
+        os.mkdir(self.source)
+        os.mkdir(self.target)
+        patcher = mock.patch.object(process_footage, "find_gyroflow_binary", return_value="gyroflow")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def write(self, folder, name, size):
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(b"x" * size)
+    
+    def rendered(self, run_streamed):
+        """Input filenames passed to Gyroflow, in call order"""
+        return [os.path.basename(c.args[0][1]) for c in run_streamed.call_args_list]
+    
+    def stabilize(self, run_streamed, **kwargs):
+        out = io.StringIO()
+        with mock.patch.object(process_footage, "run_streamed", run_streamed), \
+                contextlib.redirect_stdout(out):
+            process_footage.stabilize_footage(self.source, self.target, **kwargs)
+        return out.getvalue()
+
+
+class StabilizeFootageTest(StabilizeTestCase):
+    def test_reports_every_failure_then_raises(self):
+        for name in ("a.mp4", "b.mp4", "c.mp4"):
+            self.write(self.source, name, 10)
+        
+        def gyroflow(cmd):
+            name = os.path.basename(cmd[1])
+            if name == "a.mp4":
+                raise subprocess.CalledProcessError(1, cmd, stderr=b"decoder error")
+            if name == "c.mp4":
+                return  # exits cleanly without writing output
+            _gyroflow_writes_output(cmd)
+        
+        out = io.StringIO()
+        with self.assertRaises(RuntimeError) as ctx, contextlib.redirect_stdout(out):
+            with mock.patch.object(process_footage, "run_streamed", gyroflow):
+                process_footage.stabilize_footage(self.source, self.target, jobs=2)
+        
+        self.assertIn("2 of 3 files failed", str(ctx.exception))
+        self.assertIn("a.mp4, c.mp4", str(ctx.exception))
+        self.assertIn("✗ Error stabilizing a.mp4", out.getvalue())
+        self.assertIn("STDERR: decoder error", out.getvalue())
+        self.assertIn("✗ Error stabilizing c.mp4", out.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(self.target, "b.mp4")))
+
+    
+    def test_lpt_schedule_renders_largest_first(self):
+        for name, size in (("a.mp4", 10), ("b.mp4", 300), ("c.mp4", 200)):
+            self.write(self.source, name, size)
+        run_streamed = mock.Mock(side_effect=_gyroflow_writes_output)
+        self.stabilize(run_streamed, jobs=1, schedule="lpt")
+        self.assertEqual(self.rendered(run_streamed), ["b.mp4", "c.mp4", "a.mp4"])
+    
+    def test_name_schedule_renders_in_name_order(self):
+        for name, size in (("a.mp4", 10), ("b.mp4", 300), ("c.mp4", 200)):
+            self.write(self.source, name, size)
+        run_streamed = mock.Mock(side_effect=_gyroflow_writes_output)
+        self.stabilize(run_streamed, jobs=1, schedule="name")
+        self.assertEqual(self.rendered(run_streamed), ["a.mp4", "b.mp4", "c.mp4"])
+    
+    def test_zero_size_output_is_rendered_again(self):
+        self.write(self.source, "empty.mp4", 10)
+        self.write(self.source, "done.mp4", 10)
+        self.write(self.target, "empty.mp4", 0)
+        self.write(self.target, "done.mp4", 5)
+        run_streamed = mock.Mock(side_effect=_gyroflow_writes_output)
+        
+        output = self.stabilize(run_streamed, jobs=1)
+        
+        self.assertEqual(self.rendered(run_streamed), ["empty.mp4"])
+        self.assertIn("Skip (exists): done.mp4", output)
+        self.assertGreater(os.path.getsize(os.path.join(self.target, "empty.mp4")), 0)
+
+
+class StabilizeQueueTest(StabilizeTestCase):
+    def run_queue(self, run_streamed, paths, jobs):
+        work_queue = queue.Queue(maxsize=2)
+        out = io.StringIO()
+        
+        def consume():
+            with mock.patch.object(process_footage, "run_streamed", run_streamed), \
+                    contextlib.redirect_stdout(out):
+                process_footage.stabilize_queue(work_queue, self.target, jobs)
+        
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        for path in paths:
+            work_queue.put(path)
+        work_queue.put(None)
+        consumer.join(timeout=10)
+        self.assertFalse(consumer.is_alive(), "consumer did not stop at the sentinel")
+        return out.getvalue()
+    
+    def test_in_flight_renders_bounded_by_jobs(self):
+        paths = []
+        for i in range(6):
+            name = f"clip{i}.mp4"
+            self.write(self.source, name, 10)
+            paths.append(os.path.join(self.source, name))
+        
+        lock = threading.Lock()
+        active = [0]
+        peak = [0]
+        
+        def gyroflow(cmd):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            _gyroflow_writes_output(cmd)
+            with lock:
+                active[0] -= 1
+        
+        run_streamed = mock.Mock(side_effect=gyroflow)
+        self.run_queue(run_streamed, paths, jobs=2)
+        
+        self.assertEqual(sorted(self.rendered(run_streamed)), sorted(os.path.basename(p) for p in paths))
+        self.assertLessEqual(peak[0], 2)
+    
+    def test_busy_renders_hold_back_the_producer(self):
+        release = threading.Event()
+        
+        def gyroflow(cmd):
+            release.wait(10)
+            _gyroflow_writes_output(cmd)
+        
+        work_queue = queue.Queue(maxsize=2)
+        with mock.patch.object(process_footage, "run_streamed", gyroflow), \
+                contextlib.redirect_stdout(io.StringIO()):
+            consumer = threading.Thread(
+                target=process_footage.stabilize_queue, args=(work_queue, self.target, 1)
+            )
+            consumer.start()
+            try:
+                paths = []
+                for i in range(5):
+                    name = f"clip{i}.mp4"
+                    self.write(self.source, name, 10)
+                    paths.append(os.path.join(self.source, name))
+                # One rendering, one waiting for a slot, two queued
+                for path in paths[:4]:
+                    work_queue.put(path, timeout=1)
+                with self.assertRaises(queue.Full):
+                    work_queue.put(paths[4], timeout=0.2)
+            finally:
+                release.set()
+                work_queue.put(None)
+                consumer.join(timeout=10)
+        self.assertFalse(consumer.is_alive())
+    
+    def test_failure_is_reported_once_and_others_continue(self):
+        paths = []
+        for name in ("bad.mp4", "good.mp4"):
+            self.write(self.source, name, 10)
+            paths.append(os.path.join(self.source, name))
+        
+        def gyroflow(cmd):
+            if os.path.basename(cmd[1]) == "bad.mp4":
+                raise subprocess.CalledProcessError(1, cmd, stderr=b"decoder error")
+            _gyroflow_writes_output(cmd)
+        
+        output = self.run_queue(gyroflow, paths, jobs=1)
+        
+        self.assertEqual(output.count("bad.mp4: Command"), 1)
+        self.assertEqual(output.count("STDERR: decoder error"), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.target, "good.mp4")))
+
+
+class OutParamsTest(unittest.TestCase):
+    def test_fill_round_trips_awkward_filenames(self):
+        uri = process_footage.to_file_uri("/tmp/stabilized")
+        template = process_footage.build_out_params_template(uri)
+        for name in ('quote "name".mp4', "back\\slash.mp4", "vidéo 東京.mp4", "__NAME__.mp4"):
+            with self.subTest(name=name):
+                self.assertEqual(
+                    json.loads(process_footage.fill_out_params(template, name)),
+                    json.loads(process_footage.build_out_params(uri, name)),
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
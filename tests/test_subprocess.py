@@ -0,0 +1,44 @@
+"""Tests for dji_tools._subprocess"""
+
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+from dji_tools import _subprocess
+from dji_tools._subprocess import run_streamed
+
+
+class RunStreamedTest(unittest.TestCase):
+    def test_failure_carries_stderr_tail(self):
+        cmd = [sys.executable, "-c", "import sys; sys.stderr.write('x' * 40000 + 'END'); sys.exit(3)"]
+        with self.assertRaises(subprocess.CalledProcessError) as ctx:
+            run_streamed(cmd)
+        self.assertEqual(ctx.exception.returncode, 3)
+        self.assertTrue(ctx.exception.stderr.endswith(b"END"))
+        self.assertLessEqual(len(ctx.exception.stderr), 16 * 1024)
+    
+    def test_interrupt_kills_child(self):
+        procs = []
+        
+        class InterruptedPopen(subprocess.Popen):
+            interrupted = False
+            
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                procs.append(self)
+            
+            def wait(self, *args, **kwargs):
+                if not self.interrupted:
+                    self.interrupted = True
+                    raise KeyboardInterrupt
+                return super().wait(*args, **kwargs)
+        
+        with mock.patch.object(_subprocess.subprocess, "Popen", InterruptedPopen):
+            with self.assertRaises(KeyboardInterrupt):
+                run_streamed([sys.executable, "-c", "import time; time.sleep(30)"])
+        self.assertIsNotNone(procs[0].returncode)
+
+
+if __name__ == "__main__":
+    unittest.main()